@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import importlib
+import urllib.request
+
+import modal
+
+# --- 1. 实例规格 ---
+# <prefix>_MAX_INPUTS / <prefix>_TARGET_INPUTS 在导入应用模块时由并发装饰器读取，同时写入密钥供 /debug/stats 展示
+# module: 应用文件；name: Modal 应用名；secret: 密钥名；prefix: 密钥变量前缀（MODAL_USER_NAME_<prefix> 为该实例的用户名）
+INSTANCES = [
+    {"module": "to_app", "name": "to-app", "secret": "modal-secrets-to", "prefix": "TO"},
+    {"module": "ysl_app", "name": "ysl-app", "secret": "modal-secrets-ysl", "prefix": "YSL"},
+    {"module": "ny_app", "name": "ny-app", "secret": "modal-secrets-ny", "prefix": "NY"},
+]
+# 另外写入应用模块 TUNNEL_TUNING_KEYS 中的 <prefix>_ARGO_* 隧道调优项；未设置时为空，隧道沿用自身默认值
+SECRET_KEYS = ["UUID", "ARGO_DOMAIN", "ARGO_AUTH", "ARGO_PORT", "NAME", "CFIP", "CFPORT", "SUB_PATH", "TRANSPORTS", "USERS", "EARLY_DATA", "MUX_CONCURRENCY", "MAX_INPUTS", "TARGET_INPUTS"]
+HEALTH_TIMEOUT = int(os.environ.get('HEALTH_TIMEOUT') or '300')
+HEALTH_POLL_INTERVAL = 3
+
+# --- 2. 辅助函数 ---
+def secret_env(spec, keys):
+    prefix = spec["prefix"]
+    env = {f"{prefix}_{key}": os.environ.get(f"{prefix}_{key}", "") for key in keys}
+    env["MODAL_USER_NAME"] = os.environ.get(f"MODAL_USER_NAME_{prefix}", "")
+    return env
+
+def web_url(function):
+    getter = getattr(function, "get_web_url", None)
+    return getter() if getter else function.web_url
+
+def probe(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            return resp.status == 200
+    except Exception:
+        return False
+
+async def wait_healthy(url):
+    deadline = time.monotonic() + HEALTH_TIMEOUT
+    while time.monotonic() < deadline:
+        if await asyncio.to_thread(probe, url):
+            return True
+        await asyncio.sleep(HEALTH_POLL_INTERVAL)
+    return False
+
+# --- 3. 单实例部署：更新密钥 → 部署 → 等待新版本 /healthz 通过 ---
+# deploy 返回后 Modal 即把流量切到新版本，旧版本不会继续服务；这里只是确认新版本的数据通路
+# （Xr-ay 入站与隧道）确实可用，超时未通过时以非零状态退出，交给工作流告警或重试
+async def deploy_instance(spec):
+    name = spec["name"]
+    module = importlib.import_module(spec["module"])
+    timings = {}
+    start = time.monotonic()
+    await modal.Secret.create_deployed.aio(spec["secret"], secret_env(spec, SECRET_KEYS + list(module.TUNNEL_TUNING_KEYS)), overwrite=True)
+    timings["secret"] = time.monotonic() - start
+
+    step = time.monotonic()
+    await module.app.deploy.aio(name=name)
+    timings["deploy"] = time.monotonic() - step
+    print(f"✅ {name} 已部署，等待 /healthz ...")
+
+    step = time.monotonic()
+    url = await asyncio.to_thread(web_url, module.web_server)
+    healthy = await wait_healthy(f"{url}/healthz")
+    timings["healthy"] = time.monotonic() - step
+    timings["total"] = time.monotonic() - start
+    print(f"{'✅' if healthy else '⚠️'} {name} {'健康检查已通过' if healthy else f'{HEALTH_TIMEOUT}s 内未通过健康检查'}: {url}")
+    return healthy, timings
+
+# --- 4. 并发部署所有实例 ---
+async def main(names):
+    unknown = sorted(set(names) - {spec["name"] for spec in INSTANCES})
+    if unknown:
+        print(f"❌ 未知的应用名: {', '.join(unknown)}（可选: {', '.join(spec['name'] for spec in INSTANCES)}）")
+        return 2
+    specs = [spec for spec in INSTANCES if not names or spec["name"] in names]
+    results = await asyncio.gather(*(deploy_instance(spec) for spec in specs), return_exceptions=True)
+
+    print("\n" + "="*60)
+    failed = False
+    for spec, result in zip(specs, results):
+        if isinstance(result, BaseException):
+            failed = True
+            print(f"  ❌ {spec['name']}: {result}")
+            continue
+        healthy, timings = result
+        failed = failed or not healthy
+        detail = ", ".join(f"{key} {value:.1f}s" for key, value in timings.items())
+        print(f"  {'✅' if healthy else '⚠️'} {spec['name']}: {detail}")
+    print("="*60)
+    return 1 if failed else 0
+
+# --- 5. 生成二进制清单条目：在可信网络环境下运行，核对版本后填回各应用的 BIN_MANIFEST ---
+def print_hashes():
+    manifest = importlib.import_module("modal_app").BIN_MANIFEST
+    today = time.strftime("%Y-%m-%d")
+    for name, spec in manifest.items():
+        with urllib.request.urlopen(spec["url"], timeout=60) as resp:
+            digest = hashlib.sha256(resp.read()).hexdigest()
+        print(f'    "{name}": {json.dumps(dict(spec, checked=today, sha256=digest), ensure_ascii=False)},')
+    return 0
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--hash"]:
+        sys.exit(print_hashes())
+    sys.exit(asyncio.run(main(sys.argv[1:])))
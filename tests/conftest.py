@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+APP_MODULES = ["modal_app", "to_app", "ysl_app", "ny_app"]
+
+
+@pytest.fixture(params=APP_MODULES)
+def app_module(request):
+    return pytest.importorskip(request.param)
+
+
+@pytest.fixture
+def sub_path(app_module):
+    app = app_module.create_app()
+    return next(route.path for route in app.routes if getattr(route, "name", "") == "get_subscription")
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+
+def http_scope(path, client=("10.0.0.1", 1234), forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return {"type": "http", "path": path, "headers": headers, "client": client}
+
+
+class Recorder:
+    def __init__(self):
+        self.messages = []
+
+    async def __call__(self, message):
+        self.messages.append(message)
+
+    @property
+    def status(self):
+        return self.messages[0]["status"]
+
+
+def make_middleware(app_module, app=None):
+    async def ok(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app_module.AdmissionMiddleware(app or ok, path="/sub")
+
+
+def test_client_ip_uses_rightmost_forwarded_entry(app_module):
+    middleware = make_middleware(app_module)
+    assert middleware.client_ip(http_scope("/sub", forwarded="1.1.1.1, 2.2.2.2, 3.3.3.3")) == "3.3.3.3"
+    assert middleware.client_ip(http_scope("/sub")) == "10.0.0.1"
+
+
+def test_spoofed_forwarded_prefix_shares_one_bucket(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SUB_BURST", 2)
+    monkeypatch.setattr(app_module, "SUB_RATE", 0.001)
+    middleware = make_middleware(app_module)
+    waits = [middleware.take_token(middleware.client_ip(http_scope("/sub", forwarded=f"198.51.100.{i}, 203.0.113.7"))) for i in range(3)]
+    assert waits[:2] == [0, 0]
+    assert waits[2] > 0
+
+
+def test_token_bucket_refills_over_time(app_module, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app_module.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(app_module, "SUB_BURST", 2)
+    monkeypatch.setattr(app_module, "SUB_RATE", 1.0)
+    middleware = make_middleware(app_module)
+    assert middleware.take_token("a") == 0
+    assert middleware.take_token("a") == 0
+    assert middleware.take_token("a") == pytest.approx(1.0)
+    assert middleware.take_token("b") == 0
+    now[0] += 1.0
+    assert middleware.take_token("a") == 0
+
+
+def test_bucket_table_is_bounded(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SUB_MAX_CLIENTS", 3)
+    middleware = make_middleware(app_module)
+    for i in range(10):
+        middleware.take_token(f"ip-{i}")
+    assert len(middleware.buckets) == 3
+    assert "ip-9" in middleware.buckets
+
+
+def test_rate_limited_request_gets_429_with_retry_after(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SUB_BURST", 1)
+    monkeypatch.setattr(app_module, "SUB_RATE", 0.5)
+    middleware = make_middleware(app_module)
+
+    async def run():
+        first, second = Recorder(), Recorder()
+        await middleware(http_scope("/sub"), None, first)
+        await middleware(http_scope("/sub"), None, second)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.status == 200
+    assert second.status == 429
+    assert (b"retry-after", b"2") in second.messages[0]["headers"]
+
+
+def test_concurrency_cap_rejects_and_releases(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SUB_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(app_module, "SUB_BURST", 100)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def slow(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = make_middleware(app_module, slow)
+        held = [Recorder() for _ in range(2)]
+        tasks = [asyncio.create_task(middleware(http_scope("/sub", client=(f"10.0.0.{i}", 1)), None, recorder)) for i, recorder in enumerate(held)]
+        await asyncio.sleep(0)
+        rejected = Recorder()
+        await middleware(http_scope("/sub", client=("10.0.0.9", 1)), None, rejected)
+        release.set()
+        await asyncio.gather(*tasks)
+        after = Recorder()
+        await middleware(http_scope("/sub", client=("10.0.0.9", 1)), None, after)
+        return held, rejected, after, middleware.active
+
+    held, rejected, after, active = asyncio.run(run())
+    assert [recorder.status for recorder in held] == [200, 200]
+    assert rejected.status == 429
+    assert after.status == 200
+    assert active == 0
+
+
+def test_other_paths_bypass_admission(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SUB_MAX_CONCURRENCY", 0)
+    middleware = make_middleware(app_module)
+    recorder = Recorder()
+    asyncio.run(middleware(http_scope("/"), None, recorder))
+    assert recorder.status == 200
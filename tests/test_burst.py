@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+
+async def wait_for(predicate, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def burst(app_module, sub_path, monkeypatch):
+    stats = {"inflight": 0, "peak_inflight": 0, "total": 0}
+    monkeypatch.setattr(app_module, "_load_stats", stats)
+    monkeypatch.setattr(app_module, "SUB_BURST", 1000)
+    monkeypatch.setattr(app_module, "SUB_RATE", 1000.0)
+
+    async def run(size, concurrency):
+        monkeypatch.setattr(app_module, "SUB_MAX_CONCURRENCY", concurrency)
+        release = asyncio.Event()
+
+        async def slow_subscription(key="content"):
+            await release.wait()
+            return "c3Vi"
+
+        monkeypatch.setattr(app_module, "load_subscription", slow_subscription)
+        app = app_module.create_app()
+        held = min(size, concurrency)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            requests = [asyncio.create_task(client.get(sub_path)) for _ in range(size)]
+            await wait_for(lambda: stats["inflight"] == held and sum(task.done() for task in requests) == size - held)
+            during = (await client.get(f"{sub_path}/debug/stats")).json()
+            release.set()
+            responses = await asyncio.gather(*requests)
+        return [response.status_code for response in responses], during, stats
+
+    return run
+
+
+def test_burst_is_tracked_in_flight(burst, app_module):
+    codes, during, stats = asyncio.run(burst(size=20, concurrency=100))
+    assert codes == [200] * 20
+    # /debug/stats 自身也计入在途请求
+    assert during["inflight"] == 21
+    assert during["peak_inflight"] == 21
+    assert during["max_inputs"] == app_module.MAX_INPUTS
+    assert during["target_inputs"] == app_module.TARGET_INPUTS
+    assert stats["inflight"] == 0
+    assert stats["total"] == 21
+
+
+def test_burst_beyond_cap_is_shed_before_routing(burst):
+    codes, during, stats = asyncio.run(burst(size=12, concurrency=4))
+    assert sorted(codes) == [200] * 4 + [429] * 8
+    assert during["inflight"] == 5
+    assert stats["peak_inflight"] == 5
+    assert stats["inflight"] == 0
+    assert stats["total"] == 5
@@ -0,0 +1,35 @@
+import importlib
+import sys
+import time
+
+# 冷启动预算（秒）：导入应用模块并构建 FastAPI 应用，不含 modal 自身的导入
+COLD_START_BUDGET = 1.0
+
+
+def fresh_import(name):
+    original = sys.modules.pop(name)
+    try:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        imported = time.perf_counter()
+        module.create_app()
+        built = time.perf_counter()
+    finally:
+        sys.modules[name] = original
+    return imported - start, built - imported
+
+
+def test_cold_start_within_budget(app_module, record_property):
+    import_time, build_time = min((fresh_import(app_module.__name__) for _ in range(3)), key=sum)
+    record_property("import_ms", round(import_time * 1000, 1))
+    record_property("create_app_ms", round(build_time * 1000, 1))
+    print(f"{app_module.__name__}: import {import_time * 1000:.1f} ms, create_app {build_time * 1000:.1f} ms")
+    assert import_time + build_time < COLD_START_BUDGET
+
+
+def test_create_app_is_idempotent(app_module):
+    app = app_module.create_app()
+    routes = [(route.path, tuple(sorted(getattr(route, "methods", None) or ()))) for route in app.routes]
+    assert app_module.create_app() is app
+    assert len(app.routes) == len(routes)
+    assert len(routes) == len(set(routes))
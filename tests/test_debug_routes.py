@@ -0,0 +1,30 @@
+from collections import deque
+
+import pytest
+
+TestClient = pytest.importorskip("fastapi.testclient").TestClient
+
+
+@pytest.fixture
+def client(app_module, sub_path, monkeypatch):
+    monkeypatch.setitem(app_module._child_logs, "web", deque((f"line {i}" for i in range(5)), maxlen=10))
+    app = app_module.create_app()
+    return TestClient(app), sub_path
+
+
+def test_debug_routes_are_not_public(client):
+    http, _ = client
+    assert http.get("/debug/stats").status_code == 404
+    assert http.get("/debug/logs/web").status_code == 404
+
+
+def test_logs_return_requested_tail(client):
+    http, sub = client
+    assert http.get(f"{sub}/debug/logs/web", params={"lines": 2}).text == "line 3\nline 4"
+    assert http.get(f"{sub}/debug/logs/bot").status_code == 404
+
+
+@pytest.mark.parametrize("lines", [0, -2])
+def test_logs_reject_non_positive_lines(client, lines):
+    http, sub = client
+    assert http.get(f"{sub}/debug/logs/web", params={"lines": lines}).status_code == 400
@@ -0,0 +1,10 @@
+import asyncio
+
+import pytest
+
+deploy = pytest.importorskip("deploy")
+
+
+def test_unknown_instance_name_is_rejected(capsys):
+    assert asyncio.run(deploy.main(["to-app", "no-such-app"])) == 2
+    assert "no-such-app" in capsys.readouterr().out
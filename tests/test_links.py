@@ -0,0 +1,76 @@
+import base64
+import json
+import urllib.parse
+
+import pytest
+
+UUID = "be16536e-5c3c-44bc-8cb7-b7d0ddc3d951"
+
+
+def links_by_protocol(app_module, early_data, transports):
+    links = app_module.generate_links("node.example.com", "Node", UUID, "cf.example.com", 443, early_data, transports).split("\n\n")
+    result = {}
+    for link in links:
+        protocol = link.split("://", 1)[0]
+        if protocol == "vmess":
+            path = json.loads(base64.b64decode(link[len("vmess://"):]))["path"]
+        else:
+            path = urllib.parse.parse_qs(urllib.parse.urlsplit(link).query)["path"][0]
+        result.setdefault(protocol, []).append((link, path))
+    return result
+
+
+@pytest.mark.parametrize("transport", ["ws", "httpupgrade"])
+def test_early_data_in_every_link(app_module, transport):
+    links = links_by_protocol(app_module, 2560, [transport])
+    for protocol in ("vless", "vmess", "trojan"):
+        [(link, path)] = links[protocol]
+        assert path == app_module.node_path(protocol, transport) + "?ed=2560"
+        if protocol != "vmess":
+            # 路径整体编码：? 与 = 必须分别编码为 %3F、%3D（曾出现过 %D2560 的错误编码）
+            assert f"path=%2F{protocol}-{app_module.TRANSPORTS[transport]['suffix']}%3Fed%3D2560#" in link
+
+
+def test_early_data_disabled(app_module):
+    links = links_by_protocol(app_module, 0, ["ws"])
+    for protocol in ("vless", "vmess", "trojan"):
+        [(_, path)] = links[protocol]
+        assert "?" not in path
+
+
+def test_xhttp_links_never_carry_early_data(app_module):
+    links = links_by_protocol(app_module, 2560, ["xhttp"])
+    for protocol in ("vless", "vmess", "trojan"):
+        [(_, path)] = links[protocol]
+        assert path == app_module.node_path(protocol, "xhttp")
+
+
+def outbounds(app_module, mux_concurrency, early_data, transports):
+    return json.loads(app_module.generate_xray_outbounds("node.example.com", "Node", UUID, "cf.example.com", 443, mux_concurrency, early_data, transports))["outbounds"]
+
+
+@pytest.mark.parametrize("transports", [["ws"], ["ws", "httpupgrade", "xhttp"]])
+def test_outbounds_per_transport_and_protocol(app_module, transports):
+    result = outbounds(app_module, 0, 2560, transports)
+    assert [(outbound["streamSettings"]["network"], outbound["protocol"]) for outbound in result] == [(transport, protocol) for transport in transports for protocol in ("vless", "vmess", "trojan")]
+    assert len({outbound["tag"] for outbound in result}) == len(result)
+    for outbound in result:
+        stream = outbound["streamSettings"]
+        network = stream["network"]
+        assert stream["security"] == "tls"
+        assert stream["tlsSettings"]["serverName"] == "node.example.com"
+        assert stream[f"{network}Settings"]["path"] == app_module.node_path(outbound["protocol"], network, 2560)
+        server = (outbound["settings"].get("vnext") or outbound["settings"]["servers"])[0]
+        assert (server["address"], server["port"]) == ("cf.example.com", 443)
+
+
+def test_mux_disabled_by_default(app_module):
+    assert all(outbound["mux"] == {"enabled": False} for outbound in outbounds(app_module, 0, 0, ["ws", "httpupgrade"]))
+
+
+def test_mux_enabled_except_for_xhttp(app_module):
+    for outbound in outbounds(app_module, 8, 0, ["ws", "httpupgrade", "xhttp"]):
+        if outbound["streamSettings"]["network"] == "xhttp":
+            assert outbound["mux"] == {"enabled": False}
+        else:
+            assert outbound["mux"] == {"enabled": True, "concurrency": 8, "xudpConcurrency": 16, "xudpProxyUDP443": "reject"}
@@ -0,0 +1,45 @@
+import pytest
+
+modal_app = pytest.importorskip("modal_app")
+
+UUID = "be16536e-5c3c-44bc-8cb7-b7d0ddc3d951"
+
+
+def parse_yaml(text):
+    return dict(line.split(": ", 1) for line in text.strip().splitlines())
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("full", {"skip_procs_count": "false", "skip_connection_count": "false", "disable_send_query": "false", "ip_report_period": "1800"}),
+    ("lite", {"skip_procs_count": "true", "skip_connection_count": "true", "disable_send_query": "true", "ip_report_period": "21600"}),
+])
+def test_v1_config_per_profile(name, expected):
+    config = parse_yaml(modal_app.nezha_v1_config("nz.example.com:443", "secret", UUID, modal_app.NEZHA_PROFILES[name]))
+    assert {key: config[key] for key in expected} == expected
+    assert config["report_delay"] == "4"
+    assert config["disable_command_execute"] == "false"
+    assert config["tls"] == "true"
+    assert config["server"] == "nz.example.com:443"
+    assert config["client_secret"] == "secret"
+    assert config["uuid"] == UUID
+
+
+def test_v1_config_plain_port_disables_tls():
+    config = parse_yaml(modal_app.nezha_v1_config("nz.example.com:5555", "secret", UUID, modal_app.NEZHA_PROFILES["full"]))
+    assert config["tls"] == "false"
+
+
+@pytest.mark.parametrize("name, port, expected", [
+    ("full", "443", ["-s", "nz.example.com:443", "-p", "secret", "--tls"]),
+    ("full", "5555", ["-s", "nz.example.com:5555", "-p", "secret"]),
+    ("lite", "5555", ["-s", "nz.example.com:5555", "-p", "secret", "--skip-conn", "--skip-procs", "--report-delay", "4"]),
+])
+def test_v0_args_per_profile(name, port, expected):
+    args = modal_app.nezha_v0_args("nz.example.com", port, "secret", modal_app.NEZHA_PROFILES[name])
+    assert args == [f"{modal_app.BIN_DIR}/npm", *expected]
+    assert "--disable-command-execute" not in args
+
+
+def test_unknown_profile_warns_and_uses_full(capsys):
+    assert modal_app.nezha_profile("turbo") is modal_app.NEZHA_PROFILES["full"]
+    assert "turbo" in capsys.readouterr().out
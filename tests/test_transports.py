@@ -0,0 +1,78 @@
+import base64
+import json
+import urllib.parse
+
+import pytest
+
+UUID = "be16536e-5c3c-44bc-8cb7-b7d0ddc3d951"
+TRANSPORT_SETS = [["ws"], ["httpupgrade"], ["xhttp"], ["ws", "httpupgrade"], ["ws", "httpupgrade", "xhttp"]]
+
+
+def decode_vmess(link):
+    return json.loads(base64.b64decode(link[len("vmess://"):]))
+
+
+@pytest.mark.parametrize("raw, direct, expected", [
+    ("ws", False, ["ws"]),
+    ("ws,ws", False, ["ws"]),
+    (" httpupgrade , ws ,httpupgrade", False, ["httpupgrade", "ws"]),
+    ("xhttp", False, ["ws"]),
+    ("xhttp,httpupgrade", False, ["httpupgrade"]),
+    ("xhttp,ws", True, ["xhttp", "ws"]),
+    ("grpc,", False, ["ws"]),
+    ("", False, ["ws"]),
+])
+def test_parse_transports(app_module, raw, direct, expected):
+    assert app_module.parse_transports(raw, direct) == expected
+
+
+@pytest.mark.parametrize("transports", TRANSPORT_SETS)
+def test_build_xray_config_inbounds(app_module, transports):
+    users = {UUID: 0}
+    config = app_module.build_xray_config(8001, users, "warning", transports)
+    inbounds = config["inbounds"]
+    ports = [inbound["port"] for inbound in inbounds]
+    assert len(ports) == len(set(ports))
+    assert ports[:2] == [8001, 3001]
+    assert len(inbounds) == 2 + 3 * len(transports)
+    for inbound in inbounds[2:]:
+        stream = inbound["streamSettings"]
+        assert stream["network"] in transports
+        path = stream[f"{stream['network']}Settings"]["path"]
+        assert "?" not in path
+        assert inbound["port"] == app_module.inbound_port(inbound["protocol"], stream["network"])
+    fallbacks = inbounds[0]["settings"]["fallbacks"]
+    assert fallbacks[0] == {"dest": 3001}
+    assert {(fallback["path"], fallback["dest"]) for fallback in fallbacks[1:]} == {
+        (inbound["streamSettings"][f"{inbound['streamSettings']['network']}Settings"]["path"], inbound["port"]) for inbound in inbounds[2:]
+    }
+
+
+@pytest.mark.parametrize("transports", TRANSPORT_SETS)
+def test_generate_links_cover_every_transport(app_module, transports):
+    links = app_module.generate_links("node.example.com", "Node", UUID, "cf.example.com", 443, 0, transports).split("\n\n")
+    assert len(links) == 3 * len(transports)
+    for index, transport in enumerate(transports):
+        vless, vmess, trojan = links[index * 3:index * 3 + 3]
+        tag = "Node" if transport == "ws" else f"Node-{transport}"
+        for link, protocol in ((vless, "vless"), (trojan, "trojan")):
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(link).query)
+            assert link.startswith(f"{protocol}://{UUID}@cf.example.com:443?")
+            assert query["type"] == [transport]
+            assert query["path"] == [app_module.node_path(protocol, transport)]
+            assert urllib.parse.unquote(link.rsplit("#", 1)[1]) == tag
+        vmess_config = decode_vmess(vmess)
+        assert vmess_config["net"] == transport
+        assert vmess_config["ps"] == tag
+        assert vmess_config["path"] == app_module.node_path("vmess", transport)
+
+
+@pytest.mark.parametrize("transports", TRANSPORT_SETS)
+def test_health_probes_follow_routing(app_module, transports):
+    direct = app_module.health_probes(8001, transports, True)
+    fallback = app_module.health_probes(8001, transports, False)
+    assert [probe[0] for probe in direct] == [transport for transport in transports for _ in range(3)]
+    assert {probe[1] for probe in fallback} == {8001}
+    assert [probe[1] for probe in direct] == app_module.routed_ports(8001, transports, True)[1:]
+    assert [probe[2] for probe in direct] == [probe[2] for probe in fallback]
+    assert app_module.routed_ports(8001, transports, False) == [8001]
@@ -0,0 +1,48 @@
+import pytest
+
+TUNING = {
+    "ARGO_HA_CONNECTIONS": "4",
+    "ARGO_GRACE_PERIOD": "30s",
+    "ARGO_KEEPALIVE_CONNECTIONS": "100",
+    "ARGO_KEEPALIVE_TIMEOUT": "90s",
+    "ARGO_CONNECT_TIMEOUT": "30s",
+}
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for key in TUNING:
+        monkeypatch.delenv(f"T_{key}", raising=False)
+
+
+def test_unset_tuning_keeps_tunnel_defaults(app_module):
+    assert app_module.tunnel_tuning("T_") == ("", "")
+
+
+def test_full_tuning_renders_flags_and_origin_request(app_module, monkeypatch):
+    for key, value in TUNING.items():
+        monkeypatch.setenv(f"T_{key}", value)
+    flags, origin = app_module.tunnel_tuning("T_")
+    assert flags.split() == [
+        "--ha-connections", "4",
+        "--grace-period", "30s",
+        "--proxy-keepalive-connections", "100",
+        "--proxy-keepalive-timeout", "90s",
+        "--proxy-connect-timeout", "30s",
+    ]
+    assert origin.splitlines() == ["originRequest:", "  keepAliveConnections: 100", "  keepAliveTimeout: 90s", "  connectTimeout: 30s"]
+
+
+def test_flag_only_tuning_has_no_origin_request(app_module, monkeypatch):
+    monkeypatch.setenv("T_ARGO_HA_CONNECTIONS", "2")
+    assert app_module.tunnel_tuning("T_") == ("--ha-connections 2", "")
+
+
+def test_deploy_writes_every_tuning_key(app_module, monkeypatch):
+    deploy = pytest.importorskip("deploy")
+    spec = deploy.INSTANCES[0]
+    monkeypatch.setenv(f"{spec['prefix']}_ARGO_GRACE_PERIOD", "30s")
+    env = deploy.secret_env(spec, deploy.SECRET_KEYS + list(app_module.TUNNEL_TUNING_KEYS))
+    assert all(f"{spec['prefix']}_{key}" in env for key in app_module.TUNNEL_TUNING_KEYS)
+    assert env[f"{spec['prefix']}_ARGO_GRACE_PERIOD"] == "30s"
+    assert env[f"{spec['prefix']}_ARGO_CONNECT_TIMEOUT"] == ""
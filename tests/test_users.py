@@ -0,0 +1,33 @@
+import pytest
+
+UUID = "be16536e-5c3c-44bc-8cb7-b7d0ddc3d951"
+BULK = "0f6a3b9e-1c2d-4e5f-8a7b-9c0d1e2f3a4b"
+
+
+def test_default_config_only_has_default_policy(app_module):
+    config = app_module.build_xray_config(8001, {UUID: 0}, "warning", ["ws"])
+    assert config["policy"] == {"levels": {"0": app_module.POLICY_LEVELS[0]}}
+    assert "bufferSize" not in config["policy"]["levels"]["0"]
+
+
+def test_bulk_level_only_when_assigned(app_module):
+    config = app_module.build_xray_config(8001, {UUID: 0, BULK: 1}, "warning", ["ws"])
+    assert set(config["policy"]["levels"]) == {"0", "1"}
+    for inbound in config["inbounds"][2:]:
+        clients = inbound["settings"]["clients"]
+        assert {client.get("id", client.get("password")): client["level"] for client in clients} == {UUID: 0, BULK: 1}
+
+
+def test_parse_users_assigns_levels(app_module):
+    users = app_module.parse_users(f" {BULK}:1 , {UUID}:1", UUID)
+    assert users == {UUID: 0, BULK: 1}
+
+
+@pytest.mark.parametrize("raw", ["not-a-uuid:1", "bad\"id:0", f"{UUID[:-1]}:1", ":1"])
+def test_parse_users_skips_malformed_ids(app_module, raw):
+    assert app_module.parse_users(f"{raw},{BULK}:1", UUID) == {UUID: 0, BULK: 1}
+
+
+@pytest.mark.parametrize("level", ["", "7", "x"])
+def test_parse_users_invalid_level_falls_back_to_default(app_module, level):
+    assert app_module.parse_users(f"{BULK}:{level}", UUID) == {UUID: 0, BULK: 0}
@@ -1,11 +1,17 @@
 import os
 import re
 import json
+import math
 import time
 import base64
+import asyncio
+import threading
 import subprocess
+import urllib.parse
+import urllib.request
+import uuid
+from collections import deque
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Response
 
 import modal
 
@@ -13,36 +19,466 @@ import modal
 MODAL_APP_NAME = os.environ.get('MODAL_APP_NAME') or "ysl-app"
 MODAL_USER_NAME = os.environ.get('MODAL_USER_NAME') or ""
 DEPLOY_REGION = os.environ.get('DEPLOY_REGION') or "me-west1"  # 中东区域（适配YSL）
+# 并发输入配置：单容器同时处理的请求上限，以及自动扩缩容的目标并发（参考 /<SUB_PATH>/debug/stats 的实测数据调整）
+MAX_INPUTS = int(os.environ.get('YSL_MAX_INPUTS') or '100')
+TARGET_INPUTS = int(os.environ.get('YSL_TARGET_INPUTS') or '80')
+CONTAINER_MEMORY_MB = 128
 
 # --- 2. 定义 Modal 镜像（YSL实例专属） ---
-image = modal.Image.debian_slim().pip_install("fastapi", "uvicorn", "requests").run_commands(
-    "apt-get update && apt-get install -y curl && rm -rf /var/lib/apt/lists/*",
-    "mkdir -p /root/.tmp_ysl /root/.cache_ysl",  # 目录带YSL标识
-    "curl -L https://amd64.ssss.nyc.mn/web -o /root/.tmp_ysl/web",
-    "curl -L https://amd64.ssss.nyc.mn/2go -o /root/.tmp_ysl/bot",
-    "chmod +x /root/.tmp_ysl/web /root/.tmp_ysl/bot",
+# 二进制清单：下载地址不带版本号，sha256 是唯一的固定手段。各实例使用同一份清单与同一组镜像层，
+# 只有清单条目变化时对应的层才会重建；sha256 校验失败或未填写时镜像构建直接中止
+# version: 核对哈希时该工具的上游版本；checked: 核对哈希的日期。三项一起更新，可用 `python deploy.py --hash` 生成
+BIN_DIR = "/root/.bin"
+BIN_MANIFEST = {
+    "web": {"url": "https://amd64.ssss.nyc.mn/web", "version": "", "checked": "", "sha256": ""},    # Xr-ay
+    "bot": {"url": "https://amd64.ssss.nyc.mn/2go", "version": "", "checked": "", "sha256": ""},    # 隧道
+    "php": {"url": "https://amd64.ssss.nyc.mn/v1", "version": "", "checked": "", "sha256": ""},     # 哪吒 v1 agent
+    "npm": {"url": "https://amd64.ssss.nyc.mn/agent", "version": "", "checked": "", "sha256": ""},  # 哪吒 v0 agent
+}
+# 显式放行未填写 sha256 的条目：构建时只打印实际哈希，便于回填清单
+ALLOW_UNPINNED_BINARIES = (os.environ.get('ALLOW_UNPINNED_BINARIES') or 'false').lower() == 'true'
+
+def fetch_binary(name):
+    # 每个二进制单独一层
+    spec = BIN_MANIFEST[name]
+    path = f"{BIN_DIR}/{name}"
+    if spec["sha256"]:
+        verify = f"echo '{spec['sha256']}  {path}' | sha256sum -c -"
+    elif ALLOW_UNPINNED_BINARIES:
+        verify = f"sha256sum {path}"
+    else:
+        verify = f"sha256sum {path} && echo '❌ {name} 未在 BIN_MANIFEST 中填写 sha256，构建中止（设置 ALLOW_UNPINNED_BINARIES=true 可临时放行）' >&2 && false"
+    return f"echo '{name} {spec['version'] or '未标注版本'}（哈希核对于 {spec['checked'] or '未核对'}）' && curl -fsSL --retry 3 {spec['url']} -o {path} && {verify} && chmod +x {path}"
+
+image = (
+    modal.Image.debian_slim()
+    .pip_install("fastapi", "uvicorn", "requests")
+    .run_commands("apt-get update && apt-get install -y curl && rm -rf /var/lib/apt/lists/*", f"mkdir -p {BIN_DIR}")
+    .run_commands(fetch_binary("web"))
+    .run_commands(fetch_binary("bot"))
+    .run_commands("mkdir -p /root/.tmp_ysl /root/.cache_ysl")  # 目录带YSL标识
 )
+with image.imports():  # 仅在容器内导入，本地部署时无需安装 FastAPI
+    from fastapi import FastAPI, Response
 
 # --- 3. 定义 Modal App 和共享资源（YSL实例专属） ---
 app = modal.App(MODAL_APP_NAME, image=image)
 app_secrets = modal.Secret.from_name("modal-secrets-ysl")  # YSL专属密钥
 subscription_dict = modal.Dict.from_name("modal-dict-data-ysl", create_if_missing=True)  # 独立存储
 
+# 订阅内容的进程内缓存；并发未命中时通过单飞保护只发起一次 Dict 读取
+_sub_cache = {}
+_sub_inflight = {}
+# 订阅格式: (Dict 键, 响应类型)
+SUB_FORMATS = {
+    "base64": ("content", "text/plain"),
+    "xray": ("xray", "application/json"),
+}
+
+async def load_subscription(key="content"):
+    if _sub_cache.get(key):
+        return _sub_cache[key]
+    if key not in _sub_inflight:
+        task = asyncio.ensure_future(subscription_dict.get.aio(key))
+        task.add_done_callback(lambda _task: _sub_inflight.pop(key, None))
+        _sub_inflight[key] = task
+    content = await asyncio.shield(_sub_inflight[key])
+    if content:
+        _sub_cache[key] = content
+    return content
+
+# 负载统计：在途 HTTP 请求数及峰值，供 /<SUB_PATH>/debug/stats 使用
+_load_stats = {"inflight": 0, "peak_inflight": 0, "total": 0}
+_app_state = {}  # lifespan 中建立的状态：隧道转发端口与健康检查任务
+
+def count_established(ports):
+    # 统计本地端口上处于 ESTABLISHED 状态的 TCP 连接数，即经隧道转发给 Xr-ay 的活跃连接
+    total = 0
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path, 'r') as f: lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if fields[3] == "01" and int(fields[1].rsplit(":", 1)[1], 16) in ports:
+                total += 1
+    return total
+
 # --- 4. 辅助函数（带YSL标识） ---
-def generate_links(domain, name, uuid, cfip, cfport):
+def node_remark(name):
     try:
         meta_info_raw = subprocess.run(['curl', '-s', 'https://speed.cloudflare.com/meta'], capture_output=True, text=True, timeout=5)
         meta_info = meta_info_raw.stdout.split('"')
         isp = f"ysl_{meta_info[25]}-{meta_info[17]}".replace(' ', '_').strip()  # 带YSL前缀
     except Exception:
         isp = "Ysl-Modal-FastAPI"
-    vmess_config = {"v": "2", "ps": f"{name}-{isp}", "add": cfip, "port": cfport, "id": uuid, "aid": "0", "scy": "none", "net": "ws", "type": "none", "host": domain, "path": "/vmess-argo?ed=2560", "tls": "tls", "sni": domain, "alpn": "", "fp": "chrome"}
-    vmess_b64 = base64.b64encode(json.dumps(vmess_config).encode('utf-8')).decode('utf-8')
-    return f"""vless://{uuid}@{cfip}:{cfport}?encryption=none&security=tls&sni={domain}&fp=chrome&type=ws&host={domain}&path=%2Fvless-argo%3Fed%3D2560#{name}-{isp}\n\nvmess://{vmess_b64}\n\ntrojan://{uuid}@{cfip}:{cfport}?security=tls&sni={domain}&fp=chrome&type=ws&host={domain}&path=%2Ftrojan-argo%3Fed%3D2560#{name}-{isp}""".strip()
+    return f"{name}-{isp}"
+
+# --- Xr-ay 入站与传输方式：每种传输方式为三种协议各开一个本地入站 ---
+XRAY_PROTOCOLS = ["vless", "vmess", "trojan"]
+# 传输方式: 路径后缀与入站起始端口（vless、vmess、trojan 依次递增）
+TRANSPORTS = {
+    "ws": {"suffix": "argo", "port": 3002},
+    "httpupgrade": {"suffix": "hu", "port": 3012},
+    "xhttp": {"suffix": "xh", "port": 3022},
+}
+
+def inbound_port(protocol, transport):
+    return TRANSPORTS[transport]["port"] + XRAY_PROTOCOLS.index(protocol)
+
+def node_path(protocol, transport, early_data=0):
+    # early_data > 0 时在路径中携带 ?ed=，首包随握手请求一起发送，省去一次往返（xhttp 不适用）
+    path = f"/{protocol}-{TRANSPORTS[transport]['suffix']}"
+    return f"{path}?ed={early_data}" if early_data > 0 and transport != "xhttp" else path
+
+def parse_transports(raw, direct):
+    # 去重并保持顺序；全部被过滤时回退到 ws，保证至少有一组入站和订阅链接
+    transports = []
+    for transport in dict.fromkeys(item.strip() for item in raw.split(',')):
+        if transport not in TRANSPORTS:
+            if transport: print(f"⚠️ 未知传输方式 '{transport}'，已忽略。")
+            continue
+        if transport == "xhttp" and not direct:
+            # xhttp 的上行请求带子路径，无法经回落按路径分流，只能由 tunnel.yml 的 ingress 直连入站
+            print("⚠️ xhttp 需要 TunnelSecret 方式的固定隧道，已跳过。")
+            continue
+        transports.append(transport)
+    return transports or ["ws"]
+
+def routed_ports(argo_port, transports, direct):
+    # 隧道实际转发到的本地端口：直连模式下各传输路径直达入站，回落模式下只经过 ARGO_PORT
+    # 回落模式不计入 3002+，否则 Xr-ay 内部的回落连接会被重复统计
+    return [argo_port] + ([inbound_port(protocol, transport) for transport in transports for protocol in XRAY_PROTOCOLS] if direct else [])
+
+def health_probes(argo_port, transports, direct):
+    # 探测客户端实际经过的那一跳：直连模式连入站端口，回落模式连 ARGO_PORT 走路径回落
+    return [(transport, inbound_port(protocol, transport) if direct else argo_port, node_path(protocol, transport)) for transport in transports for protocol in XRAY_PROTOCOLS]
+
+# 用户策略等级：0 为默认等级，取值与 Xr-ay 默认一致（bufferSize 不设置，沿用默认缓冲）。
+# 1 为大流量用户（实验性，取值未经实测）：bufferSize 单位 KB，为每条连接的内部缓冲上限，调小可限制
+# 单条大流量连接占用的内存与带宽份额。只有 USERS 中显式指定等级 1 的用户才会启用该等级
+POLICY_LEVELS = {
+    0: {"handshake": 4, "connIdle": 300, "uplinkOnly": 2, "downlinkOnly": 5},
+    1: {"handshake": 4, "connIdle": 120, "uplinkOnly": 1, "downlinkOnly": 1, "bufferSize": 16},
+}
+
+def parse_users(raw, main_uuid):
+    # 格式 "uuid:level,uuid:level"；主 UUID 固定为等级 0。id 会写入所有入站，格式错误会使 Xr-ay 无法启动，须先校验
+    users = {main_uuid: 0}
+    for item in raw.split(','):
+        user_id, _, level = item.strip().partition(':')
+        if not user_id:
+            continue
+        try:
+            uuid.UUID(user_id)
+        except ValueError:
+            print(f"⚠️ 用户 id '{user_id}' 不是有效的 UUID，已跳过。")
+            continue
+        if not level.isdigit() or int(level) not in POLICY_LEVELS:
+            print(f"⚠️ 用户 {user_id} 的策略等级 '{level}' 无效，已使用等级 0。")
+            level = "0"
+        users.setdefault(user_id, int(level))
+    return users
+
+def build_xray_config(argo_port, users, loglevel, transports):
+    clients = {
+        "vless": {"clients": [{"id": user_id, "level": level} for user_id, level in users.items()], "decryption": "none"},
+        "vmess": {"clients": [{"id": user_id, "alterId": 0, "level": level} for user_id, level in users.items()]},
+        "trojan": {"clients": [{"password": user_id, "level": level} for user_id, level in users.items()]},
+    }
+    inbounds = [
+        {
+            "port": inbound_port(protocol, transport),
+            "listen": "127.0.0.1",
+            "protocol": protocol,
+            "settings": clients[protocol],
+            "streamSettings": {
+                "network": transport,
+                "security": "none",
+                f"{transport}Settings": {"path": node_path(protocol, transport)},
+            },
+        }
+        for transport in transports for protocol in XRAY_PROTOCOLS
+    ]
+    fallbacks = [{"dest": 3001}] + [{"path": node_path(protocol, transport), "dest": inbound_port(protocol, transport)} for transport in transports for protocol in XRAY_PROTOCOLS]
+    return {
+        "log": {"access": "none", "error": "", "loglevel": loglevel},
+        "policy": {"levels": {str(level): POLICY_LEVELS[level] for level in sorted(set(users.values()))}},
+        "inbounds": [
+            {
+                "port": argo_port,
+                "protocol": "vless",
+                "settings": {"clients": clients["vless"]["clients"], "decryption": "none", "fallbacks": fallbacks},
+                "streamSettings": {"network": "tcp"},
+            },
+            {
+                "port": 3001,
+                "listen": "127.0.0.1",
+                "protocol": "vless",
+                "settings": clients["vless"],
+                "streamSettings": {"network": "ws", "security": "none"},
+            },
+            *inbounds,
+        ],
+        "outbounds": [
+            {"protocol": "freedom", "tag": "direct"},
+            {"protocol": "blackhole", "tag": "block"},
+        ],
+    }
+
+def generate_links(domain, remark, uuid, cfip, cfport, early_data, transports):
+    links = []
+    for transport in transports:
+        tag = remark if transport == "ws" else f"{remark}-{transport}"
+        vless_path = urllib.parse.quote(node_path("vless", transport, early_data), safe='')
+        trojan_path = urllib.parse.quote(node_path("trojan", transport, early_data), safe='')
+        vmess_config = {"v": "2", "ps": tag, "add": cfip, "port": cfport, "id": uuid, "aid": "0", "scy": "none", "net": transport, "type": "none", "host": domain, "path": node_path("vmess", transport, early_data), "tls": "tls", "sni": domain, "alpn": "", "fp": "chrome"}
+        vmess_b64 = base64.b64encode(json.dumps(vmess_config).encode('utf-8')).decode('utf-8')
+        links += [
+            f"vless://{uuid}@{cfip}:{cfport}?encryption=none&security=tls&sni={domain}&fp=chrome&type={transport}&host={domain}&path={vless_path}#{tag}",
+            f"vmess://{vmess_b64}",
+            f"trojan://{uuid}@{cfip}:{cfport}?security=tls&sni={domain}&fp=chrome&type={transport}&host={domain}&path={trojan_path}#{tag}",
+        ]
+    return "\n\n".join(links)
+
+def generate_xray_outbounds(domain, remark, uuid, cfip, cfport, mux_concurrency, early_data, transports):
+    # Xr-ay 客户端 outbounds 格式；mux_concurrency > 0 时开启 Mux.Cool 与 XUDP 多路复用，多条短连接共用一条隧道流
+    # xhttp 自带多路复用，不再叠加 mux
+    mux = {"enabled": True, "concurrency": mux_concurrency, "xudpConcurrency": mux_concurrency * 2, "xudpProxyUDP443": "reject"} if mux_concurrency > 0 else {"enabled": False}
+    settings = {
+        "vless": {"vnext": [{"address": cfip, "port": cfport, "users": [{"id": uuid, "encryption": "none"}]}]},
+        "vmess": {"vnext": [{"address": cfip, "port": cfport, "users": [{"id": uuid, "alterId": 0, "security": "none"}]}]},
+        "trojan": {"servers": [{"address": cfip, "port": cfport, "password": uuid}]},
+    }
+    outbounds = []
+    for transport in transports:
+        tag = remark if transport == "ws" else f"{remark}-{transport}"
+        for protocol in XRAY_PROTOCOLS:
+            path = node_path(protocol, transport, early_data)
+            transport_settings = {"path": path, "headers": {"Host": domain}} if transport == "ws" else {"path": path, "host": domain}
+            stream = {"network": transport, "security": "tls", "tlsSettings": {"serverName": domain, "fingerprint": "chrome"}, f"{transport}Settings": transport_settings}
+            outbounds.append({"tag": f"{tag}-{protocol}", "protocol": protocol, "settings": settings[protocol], "streamSettings": stream, "mux": mux if transport != "xhttp" else {"enabled": False}})
+    return json.dumps({"outbounds": outbounds}, ensure_ascii=False, indent=2)
+
+# --- 子进程资源调度：数据通路（Xr-ay、隧道）优先于 Web 服务，Web 服务优先于监控 agent ---
+CHILD_PROFILES = {
+    "web": {"nice": 0, "mem_share": 0.35},  # Xr-ay
+    "bot": {"nice": 0, "mem_share": 0.25},  # 隧道
+}
+SERVER_NICE = 5  # Web 服务自身：订阅刷新等 CPU 峰值不挤占数据通路
+CHILD_MEM_CAP = (os.environ.get('YSL_CHILD_MEM_CAP') or 'true').lower() == 'true'
+_children = {}
+
+# --- 子进程日志：通过管道收集到固定大小的内存环形缓冲区 ---
+LOG_BUFFER_LINES = int(os.environ.get('YSL_LOG_BUFFER_LINES') or '500')
+LOG_SAMPLE_RATE = max(1, int(os.environ.get('YSL_LOG_SAMPLE_RATE') or '1'))  # 低于 warning 的日志每 N 行保留 1 行
+LOG_MIN_LEVEL = (os.environ.get('YSL_LOG_LEVEL') or 'info').lower()[:3]
+LOG_LEVELS = {"deb": 0, "dbg": 0, "inf": 1, "war": 2, "wrn": 2, "err": 3, "fat": 3, "pan": 3}
+LOG_LEVEL_RE = re.compile(r"\b(DBG|DEBUG|INF|INFO|WRN|WARN|WARNING|ERR|ERROR|FATAL|PANIC)\b", re.I)
+LOG_WATCH_RE = re.compile(r"https?://\S+\.trycloudflare\.com")
+_child_logs = {}
+_log_watch = {}
+
+def pump_logs(name, stream):
+    buffer = _child_logs[name]
+    min_level = LOG_LEVELS.get(LOG_MIN_LEVEL, 1)
+    sampled = 0
+    for raw in iter(stream.readline, b''):
+        line = raw.decode('utf-8', 'replace').rstrip()
+        if not line: continue
+        if name not in _log_watch:
+            watch = LOG_WATCH_RE.search(line)
+            if watch: _log_watch[name] = watch.group(0)
+        found = LOG_LEVEL_RE.search(line)
+        level = LOG_LEVELS.get(found.group(1).lower()[:3], 1) if found else 1
+        if level < min_level: continue
+        if level < 2:
+            sampled += 1
+            if sampled % LOG_SAMPLE_RATE: continue
+        buffer.append(line)
+    stream.close()
+
+def cgroup_memory_limit():
+    # 容器内存上限（字节）：优先读 cgroup v2/v1，读不到时退回函数声明的内存规格
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, 'r') as f: value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < (1 << 50):
+            return int(value)
+    return CONTAINER_MEMORY_MB << 20 if CONTAINER_MEMORY_MB else None
+
+def spawn_child(name, args, **kwargs):
+    profile = CHILD_PROFILES[name]
+    env = dict(os.environ, GOMAXPROCS="1")
+    mem_limit = cgroup_memory_limit()
+    if CHILD_MEM_CAP and mem_limit:
+        env["GOMEMLIMIT"] = f"{int(mem_limit * profile['mem_share']) >> 20}MiB"
+    proc = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+    # 启动后再调整优先级：日志线程运行时使用 preexec_fn 可能使子进程在 exec 前死锁
+    try:
+        os.setpriority(os.PRIO_PROCESS, proc.pid, profile["nice"])
+    except OSError as e:
+        print(f"⚠️ YSL实例 - 无法设置 '{name}' 的优先级: {e}")
+    _children[name] = proc
+    _child_logs.setdefault(name, deque(maxlen=LOG_BUFFER_LINES))
+    threading.Thread(target=pump_logs, args=(name, proc.stdout), daemon=True).start()
+    return proc
+
+def read_kb(path, key):
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.startswith(key + ":"): return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def memory_report():
+    # 根据 /proc 与 cgroup 内存统计评估 OOM-kill 风险
+    limit = cgroup_memory_limit()
+    used = None
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path, 'r') as f: used = int(f.read().strip()); break
+        except (OSError, ValueError):
+            continue
+    children_rss = {name: read_kb(f"/proc/{proc.pid}/status", "VmRSS") >> 10 for name, proc in _children.items() if proc.poll() is None}
+    if used is None:
+        used = (sum(children_rss.values()) << 20) + (read_kb("/proc/self/status", "VmRSS") << 10)
+    ratio = used / limit if limit else 0
+    return {
+        "limit_mb": limit >> 20 if limit else None,
+        "used_mb": used >> 20,
+        "available_mb": read_kb("/proc/meminfo", "MemAvailable") >> 10,
+        "children_rss_mb": children_rss,
+        "oom_risk": "high" if ratio >= 0.9 else "elevated" if ratio >= 0.75 else "low",
+    }
+
+# --- 深度健康检查：后台任务定时计算，/healthz 只返回缓存结果 ---
+HEALTH_INTERVAL = int(os.environ.get('YSL_HEALTH_INTERVAL') or '30')
+_health = {"ok": False, "checked_at": 0, "checks": {}}
+
+async def ws_handshake(port, path, timeout=3):
+    # 做一次回环 websocket 握手，收到 101 即视为该协议链路可用；httpupgrade 入站同样以 101 应答
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        return b" 101 " in status
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+async def port_open(port, timeout=3):
+    # xhttp 没有升级握手，只检查入站端口能否建立连接
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+def tunnel_ready(metrics_port):
+    # 隧道 metrics 服务的 /ready 在至少有一条连接注册到边缘时返回 200
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/ready", timeout=3) as resp:
+            return json.loads(resp.read()).get("readyConnections", 0) > 0
+    except Exception:
+        return False
+
+async def health_loop(probes, metrics_port):
+    while True:
+        checks = {f"proc:{name}": _children[name].poll() is None for name in ("web", "bot") if name in _children}
+        for transport, port, path in probes:
+            checks[f"{transport}:{path}"] = await (port_open(port) if transport == "xhttp" else ws_handshake(port, path))
+        checks["tunnel"] = await asyncio.to_thread(tunnel_ready, metrics_port)
+        _health.update(ok=all(checks.values()), checked_at=int(time.time()), checks=checks)
+        await asyncio.sleep(HEALTH_INTERVAL)
+
+# --- 订阅端点准入控制：按 IP 令牌桶限速 + 全局并发上限，超限时在路由之前直接返回 429 ---
+SUB_RATE = float(os.environ.get('YSL_SUB_RATE') or '0.5')  # 每个 IP 每秒补充的令牌数
+SUB_BURST = int(os.environ.get('YSL_SUB_BURST') or '5')
+SUB_MAX_CONCURRENCY = int(os.environ.get('YSL_SUB_MAX_CONCURRENCY') or '8')
+SUB_MAX_CLIENTS = 4096  # 令牌桶表的上限，超出时淘汰最早的 IP
+
+class AdmissionMiddleware:
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self.buckets = {}
+        self.active = 0
+
+    def client_ip(self, scope):
+        # 只信任最右侧一项（由前端代理追加）；左侧各项由客户端自行填写，可随意伪造
+        for key, value in scope.get("headers", []):
+            if key == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    def take_token(self, ip):
+        # 返回 0 表示放行，否则返回需要等待的秒数
+        now = time.monotonic()
+        tokens, last = self.buckets.pop(ip, (SUB_BURST, now))
+        tokens = min(SUB_BURST, tokens + (now - last) * SUB_RATE)
+        if len(self.buckets) >= SUB_MAX_CLIENTS:
+            self.buckets.pop(next(iter(self.buckets)))
+        if tokens < 1:
+            self.buckets[ip] = (tokens, now)
+            return (1 - tokens) / SUB_RATE
+        self.buckets[ip] = (tokens - 1, now)
+        return 0
+
+    async def reject(self, send, retry_after):
+        headers = [(b"retry-after", str(max(1, math.ceil(retry_after))).encode()), (b"content-type", b"text/plain; charset=utf-8")]
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": "请求过于频繁，请稍后重试。".encode('utf-8')})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+        if self.active >= SUB_MAX_CONCURRENCY:
+            return await self.reject(send, 1)
+        wait = self.take_token(self.client_ip(scope))
+        if wait:
+            return await self.reject(send, wait)
+        self.active += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
+
+# --- 隧道调优：连接器数量、优雅退出时间，以及回源 keep-alive 连接池与连接超时；未设置时沿用隧道默认值 ---
+TUNNEL_TUNING_KEYS = {
+    # 环境变量名: (命令行参数, tunnel.yml originRequest 字段)
+    "ARGO_HA_CONNECTIONS": ("--ha-connections", None),
+    "ARGO_GRACE_PERIOD": ("--grace-period", None),
+    "ARGO_KEEPALIVE_CONNECTIONS": ("--proxy-keepalive-connections", "keepAliveConnections"),
+    "ARGO_KEEPALIVE_TIMEOUT": ("--proxy-keepalive-timeout", "keepAliveTimeout"),
+    "ARGO_CONNECT_TIMEOUT": ("--proxy-connect-timeout", "connectTimeout"),
+}
+
+def tunnel_tuning(prefix):
+    flags, origin = [], []
+    for key, (flag, field) in TUNNEL_TUNING_KEYS.items():
+        value = os.environ.get(prefix + key) or ''
+        if not value: continue
+        flags.append(f"{flag} {value}")
+        if field: origin.append(f"  {field}: {value}")
+    return " ".join(flags), ("originRequest:\n" + "\n".join(origin)) if origin else ""
 
 # --- 5. FastAPI 的生命周期管理器（YSL实例配置） ---
 @asynccontextmanager
-async def lifespan(app_instance: FastAPI):
+async def lifespan(app_instance: "FastAPI"):
     # --- 应用启动时 ---
     print("▶️ YSL实例 - Lifespan startup: 正在启动后台服务...")
     
@@ -54,140 +490,75 @@ async def lifespan(app_instance: FastAPI):
     NAME = os.environ.get('YSL_NAME') or 'YslModal'
     CFIP = os.environ.get('YSL_CFIP') or 'ysl.visa.com.tw'  # YSL专属域名
     CFPORT = int(os.environ.get('YSL_CFPORT') or '443')
+    XRAY_LOGLEVEL = os.environ.get('YSL_XRAY_LOGLEVEL') or 'warning'
+    MUX_CONCURRENCY = int(os.environ.get('YSL_MUX_CONCURRENCY') or '0')  # 0 表示不开启多路复用
+    EARLY_DATA = int(os.environ.get('YSL_EARLY_DATA') or '2560')  # websocket 早期数据字节数，0 表示关闭
+    USERS = parse_users(os.environ.get('YSL_USERS') or '', UUID)  # 额外用户及其策略等级
+    DIRECT_INGRESS = bool(YSL_ARGO_DOMAIN) and "TunnelSecret" in YSL_ARGO_AUTH  # tunnel.yml 按路径直连各入站
+    TRANSPORTS_ENABLED = parse_transports(os.environ.get('YSL_TRANSPORTS') or 'ws', DIRECT_INGRESS)
+    TUNNEL_METRICS_PORT = int(os.environ.get('YSL_TUNNEL_METRICS_PORT') or '20241')
+    tunnel_flags, tunnel_origin_request = tunnel_tuning('YSL_')
     SUB_PATH = os.environ.get('YSL_SUB_PATH') or 'ysl-sub'
     
     # 启动核心服务（路径带YSL标识）
     config_json_path = "/root/.tmp_ysl/config.json"
-    config_data = {
-            "log": {
-                "access": "/dev/null",
-                "error": "/dev/null",
-                "loglevel": "none"
-            },
-            "inbounds": [
-                {
-                    "port": ARGO_PORT,
-                    "protocol": "vless",
-                    "settings": {
-                        "clients": [{"id": UUID}],
-                        "decryption": "none",
-                        "fallbacks": [
-                            {"dest": 3001},
-                            {"path": "/vless-argo", "dest": 3002},
-                            {"path": "/vmess-argo", "dest": 3003},
-                            {"path": "/trojan-argo", "dest": 3004},
-                        ]
-                    },
-                    "streamSettings": {"network": "tcp"}
-                },
-                {
-                    "port": 3001,
-                    "listen": "127.0.0.1",
-                    "protocol": "vless",
-                    "settings": {
-                        "clients": [{"id": UUID}],
-                        "decryption": "none"
-                    },
-                    "streamSettings": {
-                        "network": "ws",
-                        "security": "none"
-                    }
-                },
-                {
-                    "port": 3002,
-                    "listen": "127.0.0.1",
-                    "protocol": "vless",
-                    "settings": {
-                        "clients": [{"id": UUID, "level": 0}],
-                        "decryption": "none"
-                    },
-                    "streamSettings": {
-                        "network": "ws",
-                        "security": "none",
-                        "wsSettings": {"path": "/vless-argo"}
-                    }
-                },
-                {
-                    "port": 3003,
-                    "listen": "127.0.0.1",
-                    "protocol": "vmess",
-                    "settings": {
-                        "clients": [{"id": UUID, "alterId": 0}]
-                    },
-                    "streamSettings": {
-                        "network": "ws",
-                        "wsSettings": {"path": "/vmess-argo"}
-                    }
-                },
-                {
-                    "port": 3004,
-                    "listen": "127.0.0.1",
-                    "protocol": "trojan",
-                    "settings": {
-                        "clients": [{"password": UUID}]
-                    },
-                    "streamSettings": {
-                        "network": "ws",
-                        "security": "none",
-                        "wsSettings": {"path": "/trojan-argo"}
-                    }
-                }
-            ],
-            "outbounds": [
-                {"protocol": "freedom", "tag": "direct"},
-                {"protocol": "blackhole", "tag": "block"}
-            ]
-        }
+    config_data = build_xray_config(ARGO_PORT, USERS, XRAY_LOGLEVEL, TRANSPORTS_ENABLED)
 
     with open(config_json_path, 'w') as f: json.dump(config_data, f)
-    subprocess.Popen(["/root/.tmp_ysl/web", "-c", config_json_path])  # 路径带YSL
+    spawn_child("web", [f"{BIN_DIR}/web", "-c", config_json_path])
     print(f"✅ YSL实例 - Xr-ay 'web' 进程已启动。")
 
     domain_for_links = ""
-    argo_log_path = "/root/.tmp_ysl/argo.log"  # 日志路径带YSL
     # 核心修改：使用YSL专属Argo配置
     if YSL_ARGO_DOMAIN and YSL_ARGO_AUTH:
         domain_for_links = YSL_ARGO_DOMAIN
         if re.match(r'^[A-Z0-9a-z=]{120,250}$', YSL_ARGO_AUTH):
-            argo_args = f"tunnel --edge-ip-version auto --no-autoupdate run --token {YSL_ARGO_AUTH}"
+            argo_args = f"tunnel --metrics 127.0.0.1:{TUNNEL_METRICS_PORT} --edge-ip-version auto {tunnel_flags} --no-autoupdate run --token {YSL_ARGO_AUTH}"
         elif "TunnelSecret" in YSL_ARGO_AUTH:
             tunnel_json_path = "/root/.tmp_ysl/tunnel.json"; tunnel_yml_path = "/root/.tmp_ysl/tunnel.yml"  # 路径带YSL
             with open(tunnel_json_path, 'w') as f: f.write(YSL_ARGO_AUTH)
             tunnel_id = json.loads(YSL_ARGO_AUTH)['TunnelID']
+            # 各传输路径直接路由到对应入站，省去经 ARGO_PORT 回落的一跳
+            transport_ingress = "".join(f"  - hostname: {YSL_ARGO_DOMAIN}\n    path: ^{node_path(protocol, transport)}\n    service: http://localhost:{inbound_port(protocol, transport)}\n" for transport in TRANSPORTS_ENABLED for protocol in XRAY_PROTOCOLS)
             tunnel_yml_content = f"""
 tunnel: {tunnel_id}
 credentials-file: {tunnel_json_path}
 protocol: http2
+{tunnel_origin_request}
 
 ingress:
-  - hostname: {YSL_ARGO_DOMAIN}
+{transport_ingress}  - hostname: {YSL_ARGO_DOMAIN}
     service: http://localhost:{ARGO_PORT}
     originRequest:
       noTLSVerify: true
   - service: http_status:404
 """
             with open(tunnel_yml_path, 'w') as f: f.write(tunnel_yml_content)
-            argo_args = f"tunnel --edge-ip-version auto --config {tunnel_yml_path} run"
+            argo_args = f"tunnel --metrics 127.0.0.1:{TUNNEL_METRICS_PORT} --edge-ip-version auto {tunnel_flags} --config {tunnel_yml_path} run"
         else: raise ValueError("YSL实例 - YSL_ARGO_AUTH格式无效")  # 提示信息同步修改
-        subprocess.Popen(f"/root/.tmp_ysl/bot {argo_args}", shell=True)  # 路径带YSL
+        spawn_child("bot", [f"{BIN_DIR}/bot", *argo_args.split()])
         print(f"✅ YSL实例 - 固定隧道 ('bot') 进程已启动。")
     else:
-        argo_args = f"tunnel --edge-ip-version auto --url http://localhost:{ARGO_PORT}"
-        subprocess.Popen(f"/root/.tmp_ysl/bot {argo_args} > {argo_log_path} 2>&1", shell=True)  # 路径带YSL
-        time.sleep(10)
-        try:
-            with open(argo_log_path, 'r') as f: log_content = f.read()
-            match = re.search(r"https?://\S+\.trycloudflare\.com", log_content)
-            if match:
-                domain_for_links = match.group(0).replace("https://", "").replace("http://", "")
-                print(f"✅ YSL实例 - 临时隧道已建立: {domain_for_links}")
-            else: raise RuntimeError("YSL实例 - 无法分析临时隧道URL。")
-        except FileNotFoundError: raise RuntimeError(f"YSL实例 - Argo log 文件未找到。")
+        argo_args = f"tunnel --metrics 127.0.0.1:{TUNNEL_METRICS_PORT} --edge-ip-version auto {tunnel_flags} --url http://localhost:{ARGO_PORT}"
+        spawn_child("bot", [f"{BIN_DIR}/bot", *argo_args.split()])
+        for _ in range(40):
+            if "bot" in _log_watch: break
+            await asyncio.sleep(0.5)
+        tunnel_url = _log_watch.get("bot")
+        if tunnel_url:
+            domain_for_links = tunnel_url.replace("https://", "").replace("http://", "")
+            print(f"✅ YSL实例 - 临时隧道已建立: {domain_for_links}")
+        else: raise RuntimeError("YSL实例 - 无法分析临时隧道URL。")
     
     # 生成节点链接和订阅（带YSL标识）
-    links_str = generate_links(domain_for_links, NAME, UUID, CFIP, CFPORT)
+    remark = node_remark(NAME)
+    links_str = generate_links(domain_for_links, remark, UUID, CFIP, CFPORT, EARLY_DATA, TRANSPORTS_ENABLED)
     sub_content_b64 = base64.b64encode(links_str.encode('utf-8')).decode('utf-8')
-    subscription_dict["content"] = sub_content_b64
+    await subscription_dict.put.aio("content", sub_content_b64)
+    _sub_cache["content"] = sub_content_b64
+    xray_outbounds = generate_xray_outbounds(domain_for_links, remark, UUID, CFIP, CFPORT, MUX_CONCURRENCY, EARLY_DATA, TRANSPORTS_ENABLED)
+    await subscription_dict.put.aio("xray", xray_outbounds)
+    _sub_cache["xray"] = xray_outbounds
     print("✅ YSL实例 - 订阅内容已生成并保存到共享字典。")
 
     # 生成项目URL
@@ -196,42 +567,103 @@ ingress:
         modal_url_base = f"{MODAL_USER_NAME}--{MODAL_APP_NAME}-web_server.modal.run"
         PROJECT_URL = f"https://{modal_url_base}"
     
+    memory = memory_report()
+    print(f"ℹ️ YSL实例 - 内存: {memory['used_mb']}/{memory['limit_mb']} MiB，OOM 风险: {memory['oom_risk']}")
+
     print("\n" + "="*60)
     print("✅ YSL实例 - 所有后台服务都已运行。Web 服务已准备就绪。")
     if PROJECT_URL: print(f"  - 订阅文件下载地址: {PROJECT_URL}/{SUB_PATH}")
     print(f"  - 节点连接域名: {domain_for_links}")
     print("="*60 + "\n")
     
+    # 子进程都已按各自档位启动，再降低 Web 服务事件循环线程（及其之后创建的工作线程）的优先级
+    os.setpriority(os.PRIO_PROCESS, 0, SERVER_NICE)
+    _app_state["xray_ports"] = routed_ports(ARGO_PORT, TRANSPORTS_ENABLED, DIRECT_INGRESS)
+    _app_state["health_task"] = asyncio.create_task(health_loop(health_probes(ARGO_PORT, TRANSPORTS_ENABLED, DIRECT_INGRESS), TUNNEL_METRICS_PORT))
     yield
 
 # --- 6. FastAPI Web 应用定义（YSL实例专属路径） ---
-fastapi_app = FastAPI(lifespan=lifespan)
+fastapi_app = None
 
-@app.function(
-    secrets=[app_secrets],
-    timeout=86400,
-    keep_warm=1,
-    region=DEPLOY_REGION,
-    cpu=0.125,
-    memory=128
-)
-@modal.asgi_app()
-def web_server():
+def create_app():
+    # 应用工厂：路由只注册一次，重复调用直接返回已构建的实例
+    global fastapi_app
+    if fastapi_app is not None:
+        return fastapi_app
     SUB_PATH = os.environ.get('YSL_SUB_PATH') or 'ysl-sub'  # 路径带YSL标识
+    ARGO_PORT = int(os.environ.get('YSL_ARGO_PORT') or '8001')
+    fastapi_app = FastAPI(lifespan=lifespan)
+
+    @fastapi_app.middleware("http")
+    async def track_inflight(request, call_next):
+        _load_stats["inflight"] += 1
+        _load_stats["total"] += 1
+        _load_stats["peak_inflight"] = max(_load_stats["peak_inflight"], _load_stats["inflight"])
+        try:
+            return await call_next(request)
+        finally:
+            _load_stats["inflight"] -= 1
+
+    fastapi_app.add_middleware(AdmissionMiddleware, path=f"/{SUB_PATH}")
+
+    @fastapi_app.get("/healthz")
+    def healthz():
+        return Response(content=json.dumps(_health), status_code=200 if _health["ok"] else 503, media_type="application/json")
 
     @fastapi_app.get("/")
     def root():
         return Response(content="YSL实例服务运行中", media_type="text/html; charset=utf-8")
 
     @fastapi_app.get(f"/{SUB_PATH}")
-    def get_subscription():
+    async def get_subscription(format: str = "base64"):
+        if format not in SUB_FORMATS:
+            return Response(content=f"YSL实例不支持的订阅格式: {format}", status_code=400, media_type="text/plain; charset=utf-8")
+        key, media_type = SUB_FORMATS[format]
         try:
-            content = subscription_dict.get("content")
+            content = await load_subscription(key)
             if content:
-                return Response(content=content, media_type="text/plain")
+                return Response(content=content, media_type=media_type)
             else:
                 return Response(content="YSL实例订阅内容尚未生成，请稍后重试。", status_code=503, media_type="text/plain; charset=utf-8")
         except Exception as e:
             return Response(content=f"YSL实例读取订阅时发生错误: {e}", status_code=500, media_type="text/plain; charset=utf-8")
-    
+
+    # 调试端点挂在不可猜测的 SUB_PATH 之下，不在公开地址上暴露客户端 IP 与访问目标
+    @fastapi_app.get(f"/{SUB_PATH}/debug/stats")
+    def get_stats():
+        return {
+            **_load_stats,
+            "xray_connections": count_established(_app_state.get("xray_ports", [ARGO_PORT])),
+            "max_inputs": MAX_INPUTS,
+            "target_inputs": TARGET_INPUTS,
+            "memory": memory_report(),
+        }
+
+    @fastapi_app.get(f"/{SUB_PATH}/debug/logs/{{proc}}")
+    def get_logs(proc: str, lines: int = 200):
+        buffer = _child_logs.get(proc)
+        if buffer is None:
+            return Response(content=f"未知进程: {proc}", status_code=404, media_type="text/plain; charset=utf-8")
+        if lines < 1:
+            return Response(content=f"lines 必须为正整数: {lines}", status_code=400, media_type="text/plain; charset=utf-8")
+        return Response(content="\n".join(list(buffer)[-lines:]), media_type="text/plain; charset=utf-8")
+
     return fastapi_app
+
+# 内存快照：容器内导入模块时（快照之前）即构建好应用，恢复后只由 lifespan 启动子进程
+if not modal.is_local():
+    create_app()
+
+@app.function(
+    secrets=[app_secrets],
+    timeout=86400,
+    keep_warm=1,
+    region=DEPLOY_REGION,
+    cpu=0.125,
+    memory=CONTAINER_MEMORY_MB,
+    enable_memory_snapshot=True
+)
+@modal.concurrent(max_inputs=MAX_INPUTS, target_inputs=TARGET_INPUTS)
+@modal.asgi_app()
+def web_server():
+    return create_app()